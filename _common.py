@@ -0,0 +1,92 @@
+"""Constants and helpers shared by :mod:`api` and :mod:`cf`.
+
+Import-time path resolution (``Path(__file__).resolve()`` walks the real
+path with syscalls) and the cache/executor singletons live here so both
+modules pay for them once and work against the same state instead of
+competing copies.
+"""
+
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import orjson
+
+    def _loads(raw):
+        return orjson.loads(raw)
+
+    def _dumps_raw(obj) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:
+    def _loads(raw):
+        if isinstance(raw, memoryview):
+            raw = raw.tobytes()
+        return json.loads(raw)
+
+    def _dumps_raw(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+ROOT = Path(__file__).resolve().parent
+USER_DIR = ROOT / "user"
+WORKFLOWS_DIR = USER_DIR / "workflows"
+SRC_DIR = USER_DIR / "exports"
+
+# Parsed-workflow cache keyed by path string.  Each record carries the
+# stat signature it was built from, so a file edited on disk is re-read
+# transparently on the next request.
+_CACHE: dict[str, dict] = {}
+_CACHE_LOCK = threading.Lock()
+
+# Shared pool for blocking file work; sized for I/O-bound fan-out and
+# doubling as the concurrency bound so a large directory cannot exhaust
+# file descriptors.
+_EXECUTOR = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4))
+
+
+def _load_json(path):
+    """Parse a JSON file straight out of a read-only mapping.
+
+    orjson consumes the memoryview without an intermediate bytes copy,
+    so peak memory during a scan stays at one mapping per file; the
+    stdlib fallback converts the view since json.loads needs bytes.
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        try:
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file cannot be mapped (and is not valid JSON anyway)
+            return _loads(b"")
+        with mm:
+            view = memoryview(mm)
+            try:
+                return _loads(view)
+            finally:
+                view.release()
+    finally:
+        os.close(fd)
+
+
+def _is_api_graph(data) -> bool:
+    """True when *data* looks like an API-format prompt graph.
+
+    API exports are flat ``{node_id: {"class_type": ..., "inputs": ...}}``
+    mappings; UI exports carry a top-level ``nodes`` list instead.
+    """
+    if not isinstance(data, dict):
+        return False
+    if isinstance(data.get("nodes"), list):
+        return False
+    # One node-shaped value is decisive; checking the first few entries
+    # beats walking thousands of nodes (keys from JSON are always str).
+    it = iter(data.values())
+    for _ in range(3):
+        v = next(it, None)
+        if isinstance(v, dict) and "class_type" in v and "inputs" in v:
+            return True
+    return False
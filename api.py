@@ -1 +1,473 @@
+"""aiohttp endpoints for browsing CVB workflow files.
 
+Routes are registered on ComfyUI's ``PromptServer`` when the module is
+loaded as a custom node; outside ComfyUI they land on a plain
+``RouteTableDef`` so the module stays importable for tooling.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import mmap
+import os
+import re
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+from aiohttp import web
+
+try:
+    from ._common import (
+        WORKFLOWS_DIR,
+        _CACHE,
+        _CACHE_LOCK,
+        _EXECUTOR,
+        _dumps_raw,
+        _is_api_graph,
+        _load_json,
+        _loads,
+    )
+except ImportError:
+    from _common import (
+        WORKFLOWS_DIR,
+        _CACHE,
+        _CACHE_LOCK,
+        _EXECUTOR,
+        _dumps_raw,
+        _is_api_graph,
+        _load_json,
+        _loads,
+    )
+
+try:
+    from server import PromptServer
+
+    routes = PromptServer.instance.routes
+except ImportError:
+    routes = web.RouteTableDef()
+
+_CORS = {"Access-Control-Allow-Origin": "*"}
+
+# %-templates beat f-strings in the per-entry listing loop, and the
+# built item is memoized on the cache record anyway.
+_RAW_FMT = "/cvb/workflows/%s?format=raw"
+_API_FMT = "/cvb/workflows/%s?format=api"
+
+# Precomputed index sidecar: the full listing payload is persisted next
+# to the workflows and served as a file while the directory signature it
+# was built from still matches.
+_INDEX_PATH = WORKFLOWS_DIR / "_index.json"
+_INDEX_SIG = None
+_INDEX_LOCK = threading.Lock()
+
+# True once a directory watcher (or the poll fallback) keeps the index
+# current; the listing then trusts the sidecar without rescanning.
+_WATCHING = False
+_WATCH_INTERVAL = 2.0
+
+
+def _list_files() -> list[tuple[str, str]]:
+    """Sorted (name, full path) pairs for every workflow file.
+
+    Plain strings on purpose: the listing touches every entry on every
+    request and Path construction is costly there; Path objects stay at
+    the single-file API boundary.  scandir's DirEntry.is_file reuses
+    d_type from the directory read, so this costs no per-entry stat.
+    """
+    try:
+        with os.scandir(WORKFLOWS_DIR) as it:
+            return sorted(
+                (e.name, e.path)
+                for e in it
+                if e.name.endswith(".json")
+                and e.name != _INDEX_PATH.name
+                and e.is_file(follow_symlinks=False)
+            )
+    except FileNotFoundError:
+        return []
+
+
+def _read_all(path) -> bytes:
+    """Read a whole file with one positioned read (no seek), O_CLOEXEC set."""
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        return os.pread(fd, os.fstat(fd).st_size, 0)
+    finally:
+        os.close(fd)
+
+
+def _json_response(obj, status: int = 200, headers=None) -> web.Response:
+    return web.Response(
+        body=_dumps_raw(obj),
+        status=status,
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+# UI exports open with a small header before the "nodes" list, so a
+# bounded search over the head of the file is enough to spot one.
+_NODES_RE = re.compile(rb'"nodes"\s*:\s*\[')
+_SNIFF_LIMIT = 64 * 1024
+
+
+def _classify_fast(path) -> tuple:
+    """Classify *path* as (is_api, meta) without a full JSON parse.
+
+    The file is mmapped and byte-scanned: a ``"nodes": [`` near the start
+    marks a UI export, a ``"class_type"`` anywhere marks an API graph.
+    Only ambiguous files, or ones carrying a ``cvb_meta`` block, pay for
+    the full parse.
+    """
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file: let the full parse raise, so it gets the same
+            # error entry as any other unparseable workflow.
+            data = _load_json(path)
+            return _is_api_graph(data), _meta_from(data)
+        with mm:
+            if _NODES_RE.search(mm, 0, _SNIFF_LIMIT):
+                is_api = False
+            elif mm.find(b'"class_type"') != -1:
+                is_api = True
+            else:
+                data = _load_json(path)
+                return _is_api_graph(data), _meta_from(data)
+            if mm.find(b'"cvb_meta"') == -1:
+                return is_api, {}
+    data = _load_json(path)
+    return _is_api_graph(data), _meta_from(data)
+
+
+def _meta_from(data) -> dict:
+    """Pull the optional ``cvb_meta`` block out of a workflow graph."""
+    if not isinstance(data, dict):
+        return {}
+    meta = data.get("cvb_meta")
+    if meta is None and isinstance(data.get("extra"), dict):
+        meta = data["extra"].get("cvb_meta")
+    return meta if isinstance(meta, dict) else {}
+
+
+def _cache_entry(path: str, need_raw: bool = False) -> dict:
+    """Return the cache record for *path*, refreshing if the file changed.
+
+    The listing only needs classification and metadata, which the sniff
+    in :func:`_classify_fast` provides without reading the whole file;
+    callers that serve the body pass ``need_raw=True`` to force the
+    full read on a sniff-only record.
+    """
+    st = os.stat(path)
+    with _CACHE_LOCK:
+        entry = _CACHE.get(path)
+        if (
+            entry is not None
+            and entry["mtime_ns"] == st.st_mtime_ns
+            and entry["size"] == st.st_size
+            and (entry["raw"] is not None or not need_raw)
+        ):
+            return entry
+    if need_raw:
+        raw = _read_all(path)
+        data = _loads(raw)
+        is_api = _is_api_graph(data)
+        meta = _meta_from(data)
+    else:
+        raw = data = None
+        is_api, meta = _classify_fast(path)
+    entry = {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "raw": raw,
+        "data": data,
+        "is_api": is_api,
+        "meta": meta,
+    }
+    with _CACHE_LOCK:
+        _CACHE[path] = entry
+    return entry
+
+
+def _prune_cache(live: set) -> None:
+    """Drop cache records for files that no longer exist on disk."""
+    with _CACHE_LOCK:
+        for path in list(_CACHE):
+            if path not in live:
+                del _CACHE[path]
+
+
+def _dir_signature(files):
+    """Stat every file into (name, mtime_ns, size) tuples, or None on a race."""
+    try:
+        return [
+            (name, st.st_mtime_ns, st.st_size)
+            for name, st in ((name, os.stat(path)) for name, path in files)
+        ]
+    except OSError:
+        return None
+
+
+def _write_index(body: bytes, sig) -> None:
+    global _INDEX_SIG
+    with _INDEX_LOCK:
+        tmp = _INDEX_PATH.with_name(_INDEX_PATH.name + ".tmp")
+        try:
+            tmp.write_bytes(body)
+            os.replace(tmp, _INDEX_PATH)
+        except OSError:
+            return
+        _INDEX_SIG = sig
+
+
+def _etag_of(sig) -> str:
+    return '"%s"' % hashlib.blake2b(repr(sig).encode(), digest_size=16).hexdigest()
+
+
+def _rebuild_index() -> None:
+    """Build the sidecar index from the current directory contents."""
+    files = _list_files()
+    sig = _dir_signature(files)
+    if sig is None:
+        return
+    _write_index(_dumps_raw([_process_one(name, path) for name, path in files]), sig)
+
+
+def _process_one(name: str, path: str) -> dict:
+    """Stat, sniff and describe one workflow file for the index."""
+    try:
+        entry = _cache_entry(path)
+    except (OSError, ValueError) as exc:
+        return {"name": name, "error": str(exc)}
+    item = entry.get("item")
+    if item is None:
+        meta = entry["meta"]
+        item = {
+            "name": name,
+            "title": meta.get("title", name[: -len(".json")]),
+            "description": meta.get("description", ""),
+            "tags": meta.get("tags", []),
+            "kind": "api" if entry["is_api"] else "ui",
+            "raw_url": _RAW_FMT % name,
+            "api_url": _API_FMT % name,
+        }
+        entry["item"] = item
+    return item
+
+
+@routes.get("/cvb/workflows")
+async def list_workflows(request: web.Request) -> web.Response:
+    if _WATCHING:
+        # The watcher keeps the sidecar current, so the hot path is a
+        # header check plus a file send — no directory scan at all.
+        with _INDEX_LOCK:
+            sig = _INDEX_SIG
+        if sig is not None and _INDEX_PATH.is_file():
+            etag = _etag_of(sig)
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={**_CORS, "ETag": etag})
+            headers = {
+                **_CORS,
+                "ETag": etag,
+                "Cache-Control": "no-cache",
+                "Content-Type": "application/json",
+            }
+            return web.FileResponse(_INDEX_PATH, headers=headers)
+    files = _list_files()
+    _prune_cache({path for _, path in files})
+    headers = dict(_CORS)
+    sig = _dir_signature(files)  # None if a file vanished mid-scan
+    if sig is not None:
+        etag = _etag_of(sig)
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={**_CORS, "ETag": etag})
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+        if sig == _INDEX_SIG and _INDEX_PATH.is_file():
+            headers["Content-Type"] = "application/json"
+            return web.FileResponse(_INDEX_PATH, headers=headers)
+    # Rebuild path: stream entries as the workers finish them, so the
+    # first byte goes out before the slowest file is parsed and the full
+    # payload is never held twice (list + encoded body).
+    loop = asyncio.get_running_loop()
+    tasks = [
+        loop.run_in_executor(_EXECUTOR, _process_one, name, path)
+        for name, path in files
+    ]
+    headers["Content-Type"] = "application/json"
+    resp = web.StreamResponse(headers=headers)
+    await resp.prepare(request)
+    await resp.write(b"[")
+    chunks = []
+    sep = b""
+    for fut in asyncio.as_completed(tasks):
+        chunk = _dumps_raw(await fut)
+        chunks.append(chunk)
+        await resp.write(sep + chunk)
+        sep = b","
+    await resp.write(b"]")
+    await resp.write_eof()
+    if sig is not None:
+        body = b"[" + b",".join(chunks) + b"]"
+        await loop.run_in_executor(_EXECUTOR, _write_index, body, sig)
+    return resp
+
+
+async def _serve_workflow(request: web.Request, name: str, fmt: str) -> web.Response:
+    """Serve one workflow file; shared by the workflow and template routes."""
+    path = WORKFLOWS_DIR / name
+    # The index sidecar lives in the workflow directory but is not a
+    # workflow; keep it as invisible here as in the listing.
+    if (
+        not name.endswith(".json")
+        or name == _INDEX_PATH.name
+        or not path.is_file()
+    ):
+        return _json_response(
+            {"error": f"unknown workflow {name!r}"}, status=404, headers=_CORS
+        )
+    try:
+        st = path.stat()
+    except OSError as exc:
+        return _json_response({"error": str(exc)}, status=500, headers=_CORS)
+    etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        **_CORS,
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if request.headers.get("If-None-Match") == etag or (
+        "If-None-Match" not in request.headers
+        and request.headers.get("If-Modified-Since") == headers["Last-Modified"]
+    ):
+        return web.Response(status=304, headers=headers)
+    key = str(path)
+    if fmt != "api":
+        # Fresh cached bytes make a repeat raw request a dict lookup plus
+        # one Response construction; otherwise let aiohttp stream the
+        # file with sendfile instead of copying through userspace.
+        with _CACHE_LOCK:
+            entry = _CACHE.get(key)
+            raw = (
+                entry["raw"]
+                if entry is not None
+                and entry["mtime_ns"] == st.st_mtime_ns
+                and entry["size"] == st.st_size
+                else None
+            )
+        if raw is not None:
+            headers["Content-Length"] = str(len(raw))
+            return web.Response(
+                body=raw, content_type="application/json", headers=headers
+            )
+        headers["Content-Type"] = "application/json"
+        return web.FileResponse(path, headers=headers)
+    loop = asyncio.get_running_loop()
+    try:
+        entry = await loop.run_in_executor(
+            _EXECUTOR, lambda: _cache_entry(key, need_raw=True)
+        )
+    except (OSError, ValueError) as exc:
+        return _json_response({"error": str(exc)}, status=500, headers=_CORS)
+    if not entry["is_api"]:
+        return _json_response(
+            {"error": f"{name} is a UI export, not an API graph"},
+            status=409,
+            headers=_CORS,
+        )
+    raw = entry["raw"]
+    headers["Content-Length"] = str(len(raw))
+    return web.Response(
+        body=raw, content_type="application/json", headers=headers
+    )
+
+
+@routes.get("/cvb/workflows/{name}")
+async def get_workflow(request: web.Request) -> web.Response:
+    name = Path(request.match_info.get("name", "")).name
+    fmt = request.query.get("format", "raw").lower()
+    return await _serve_workflow(request, name, fmt)
+
+
+@routes.get("/cvb/templates/{name}")
+async def get_template_alias(request: web.Request) -> web.Response:
+    """Serve ``/cvb/templates/<name>`` as the matching API-format workflow."""
+    name = Path(request.match_info.get("name", "")).name
+    if not name.endswith(".json"):
+        name += ".json"
+    return await _serve_workflow(request, name, "api")
+
+
+def _refresh_if_changed() -> None:
+    """Re-sync the cache and sidecar when the directory content moved."""
+    files = _list_files()
+    sig = _dir_signature(files)
+    with _INDEX_LOCK:
+        current = _INDEX_SIG
+    if sig is None or sig == current:
+        return
+    _prune_cache({path for _, path in files})
+    _rebuild_index()
+
+
+def _poll_loop() -> None:
+    while True:
+        time.sleep(_WATCH_INTERVAL)
+        with contextlib.suppress(Exception):
+            _refresh_if_changed()
+
+
+def _start_watcher() -> None:
+    """Keep the index live via inotify (watchdog) or an mtime poll.
+
+    watchdog is optional like orjson: its InotifyObserver avoids even the
+    periodic directory scan, and the poll thread covers every other
+    setup. Either way _WATCHING flips on and the listing stops scanning
+    per request.
+    """
+    global _WATCHING
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        _WATCHING = True
+        threading.Thread(target=_poll_loop, name="cvb-watch", daemon=True).start()
+        return
+
+    class _Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if not event.is_directory:
+                with contextlib.suppress(Exception):
+                    _refresh_if_changed()
+
+    try:
+        observer = Observer()
+        observer.daemon = True
+        observer.schedule(_Handler(), str(WORKFLOWS_DIR))
+        observer.start()
+        _WATCHING = True
+    except OSError:
+        _WATCHING = True
+        threading.Thread(target=_poll_loop, name="cvb-watch", daemon=True).start()
+
+
+def _warm_cache() -> None:
+    """Pre-populate the cache and index so the first request pays nothing.
+
+    Runs in a daemon thread started at import (i.e. at ComfyUI startup);
+    a broken file is skipped rather than aborting the warm-up. Once the
+    initial index exists, hands off to the directory watcher.
+    """
+    for _, path in _list_files():
+        with contextlib.suppress(Exception):
+            _cache_entry(path)
+    with contextlib.suppress(Exception):
+        _rebuild_index()
+    _start_watcher()
+
+
+threading.Thread(target=_warm_cache, name="cvb-warm-cache", daemon=True).start()
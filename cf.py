@@ -1 +1,111 @@
+"""Conversion of workflow exports into the served workflows folder.
 
+``convert_all`` copies API-format graphs from the exports directory into
+``WORKFLOWS_DIR`` byte-for-byte; UI exports are skipped since they need
+the frontend to produce a prompt graph.
+"""
+
+import fnmatch
+import os
+import shutil
+from pathlib import Path
+
+from aiohttp import web
+
+try:
+    from ._common import (
+        SRC_DIR,
+        WORKFLOWS_DIR,
+        _EXECUTOR,
+        _is_api_graph,
+        _load_json,
+    )
+except ImportError:
+    from _common import (
+        SRC_DIR,
+        WORKFLOWS_DIR,
+        _EXECUTOR,
+        _is_api_graph,
+        _load_json,
+    )
+
+try:
+    from server import PromptServer
+
+    routes = PromptServer.instance.routes
+except ImportError:
+    routes = web.RouteTableDef()
+
+
+def _convert_one(path: Path, dest_dir: Path, overwrite: bool) -> tuple:
+    """Convert a single export, returning ('converted'|'skipped', name)."""
+    out_path = dest_dir / path.name
+    try:
+        src_st = path.stat()
+    except OSError:
+        return "skipped", path.name
+    try:
+        dst_st = out_path.stat()
+    except OSError:
+        dst_st = None
+    if (
+        dst_st is not None
+        and not overwrite
+        and dst_st.st_mtime_ns >= src_st.st_mtime_ns
+    ):
+        return "skipped", path.name
+    try:
+        data = _load_json(path)
+    except (OSError, ValueError):
+        return "skipped", path.name
+    if not _is_api_graph(data):
+        return "skipped", path.name
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    # The source already is the output: copy the bytes verbatim instead
+    # of re-encoding the graph we just parsed (and keep the author's
+    # original formatting).
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, out_path)
+    return "converted", out_path.name
+
+
+def convert_all(
+    source_dir: Path = SRC_DIR,
+    dest_dir: Path = WORKFLOWS_DIR,
+    glob: str = "*.json",
+    overwrite: bool = False,
+) -> tuple[list, list]:
+    """Convert every matching export, returning (converted, skipped) names."""
+    converted: list = []
+    skipped: list = []
+    # scandir avoids the extra stat per entry that glob + is_file pays.
+    try:
+        with os.scandir(source_dir) as it:
+            paths = sorted(
+                Path(e.path)
+                for e in it
+                if e.is_file(follow_symlinks=False)
+                and fnmatch.fnmatchcase(e.name, glob)
+            )
+    except FileNotFoundError:
+        return converted, skipped
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    results = _EXECUTOR.map(lambda p: _convert_one(p, dest_dir, overwrite), paths)
+    for status, name in results:
+        (converted if status == "converted" else skipped).append(name)
+    if converted:
+        # One directory fsync makes the whole batch of renames durable,
+        # instead of paying a flush per file.
+        fd = os.open(dest_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return converted, skipped
+
+
+@routes.post("/cvb/convert")
+async def http_convert_all(request: web.Request) -> web.Response:
+    overwrite = request.query.get("overwrite", "0").lower() in ("1", "true", "yes")
+    converted, skipped = convert_all(overwrite=overwrite)
+    return web.json_response({"converted": converted, "skipped": skipped})